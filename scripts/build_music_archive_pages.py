@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import pathlib, yaml, re
+import os, pathlib
 
 DATA_DIR = pathlib.Path("_data/lastfm")
 OUT_DIR  = pathlib.Path("musik")
@@ -9,50 +9,60 @@ LAYOUT_MONTH = "music_month"
 
 def years_months():
     result = {}
-    if not DATA_DIR.exists(): return result
-    for ydir in sorted(DATA_DIR.iterdir()):
-        if not ydir.is_dir(): continue
-        y = ydir.name
-        months = []
-        for mfile in sorted((ydir).glob("*.yml")):
-            mm = mfile.stem
-            months.append(mm)
+    try:
+        with os.scandir(DATA_DIR) as it:
+            years = sorted((e.name, e.path) for e in it if e.is_dir())
+    except FileNotFoundError:
+        return result
+    for y, ypath in years:
+        with os.scandir(ypath) as it:
+            months = sorted(e.name[:-4] for e in it if e.is_file() and e.name.endswith(".yml"))
         if months:
             result[y] = months
     return result
 
-def write_year_page(y):
-    p = OUT_DIR / y / "index.html"
+# Front matter, precompiled once as bytes; filled with %-formatting per page.
+YEAR_TMPL = (
+    "---\n"
+    f"layout: {LAYOUT_YEAR}\n"
+    "title: Musik %s\n"
+    "permalink: /musik/%s/\n"
+    'year: "%s"\n'
+    "---\n"
+).encode("utf-8")
+MONTH_TMPL = (
+    "---\n"
+    f"layout: {LAYOUT_MONTH}\n"
+    "title: Musik %s/%s\n"
+    "permalink: /musik/%s/%s/\n"
+    'year: "%s"\n'
+    'month: "%s"\n'
+    "---\n"
+).encode("utf-8")
+
+def write_page(p, data):
+    """Write data to p unless it already has exactly these bytes; returns 1 if written."""
+    if p.exists() and p.read_bytes() == data:
+        return 0
     p.parent.mkdir(parents=True, exist_ok=True)
-    front = f"""---
-layout: {LAYOUT_YEAR}
-title: Musik {y}
-permalink: /musik/{y}/
-year: "{y}"
----
-"""
-    p.write_text(front, encoding="utf-8")
+    p.write_bytes(data)
+    return 1
+
+def write_year_page(y):
+    yb = y.encode()
+    return write_page(OUT_DIR / y / "index.html", YEAR_TMPL % (yb, yb, yb))
 
 def write_month_page(y, m):
-    p = OUT_DIR / y / m / "index.html"
-    p.parent.mkdir(parents=True, exist_ok=True)
-    front = f"""---
-layout: {LAYOUT_MONTH}
-title: Musik {y}/{m}
-permalink: /musik/{y}/{m}/
-year: "{y}"
-month: "{m}"
----
-"""
-    p.write_text(front, encoding="utf-8")
+    yb, mb = y.encode(), m.encode()
+    return write_page(OUT_DIR / y / m / "index.html", MONTH_TMPL % (yb, mb, yb, mb, yb, mb))
 
 def main():
     ym = years_months()
     total = 0
     for y, months in ym.items():
-        write_year_page(y); total += 1
+        total += write_year_page(y)
         for m in months:
-            write_month_page(y, m); total += 1
+            total += write_month_page(y, m)
     print(f"[OK] Archivseiten erzeugt/aktualisiert: {total}")
 
 if __name__ == "__main__":
@@ -8,24 +8,220 @@ Adds debug mode (--debug) to print missing fields into logs.
 
 import os
 import sys
+import json
 import time
+import sqlite3
 import argparse
+import threading
 import yaml
 import requests
-import statistics
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# str or bytes in, same objects as json.loads
+json_loads = orjson.loads if orjson else json.loads
+
+try:  # libyaml C bindings, ~10x faster than the pure-Python parser/emitter
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+
+# Fields that mark a record as fully enriched; such records are skipped
+# unless --force is given.
+MOVIE_FIELDS = ("tmdb", "poster", "backdrop", "runtime", "title_de", "overview_de", "imdb")
+EPISODE_DETAIL_FIELDS = ("season_total_episodes", "episode_title", "episode_title_de",
+                         "episode_runtime", "episode_still")
+EPISODE_FIELDS = ("tmdb", "imdb", "tvdb", "show_title_de", "show_poster", "show_backdrop",
+                  "show_total_episodes") + EPISODE_DETAIL_FIELDS
+
+
+# TMDB image settings change very rarely; these are used when /configuration
+# has never been fetched successfully. A fetched copy is kept for 30 days.
+DEFAULT_IMAGE_CONFIG = {
+    "secure_base_url": "https://image.tmdb.org/t/p/",
+    "poster_sizes": ["w500"],
+    "backdrop_sizes": ["w780"],
+    "still_sizes": ["w300"],
+}
+IMAGE_CONFIG_MAX_AGE = 30 * 86400
+# Lookups that found nothing are cached as null and retried after this long,
+# whatever the cache's own ttl, in case TMDB/Trakt pick the title up later.
+NEGATIVE_TTL = 30 * 86400
 
 
 # ---------- IO helpers ----------
 def load_yaml(p: Path):
-    with open(p, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or []
+    # Binary mode: libyaml reads the stream in chunks and decodes UTF-8 itself
+    with open(p, "rb") as f:
+        return yaml.load(f, Loader=SafeLoader) or []
 
 
 def dump_yaml(p: Path, data):
+    """Write data as YAML, leaving the file untouched if the content is unchanged."""
+    new = yaml.dump(data, Dumper=SafeDumper, allow_unicode=True, sort_keys=False).encode("utf-8")
+    if p.exists() and p.read_bytes() == new:
+        return
     p.parent.mkdir(parents=True, exist_ok=True)
-    with open(p, "w", encoding="utf-8") as f:
-        yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+    p.write_bytes(new)
+
+
+def response_json(r):
+    """Decode a JSON response body, via orjson when it is installed."""
+    return orjson.loads(r.content) if orjson else r.json()
+
+
+class RateLimiter:
+    """Token bucket shared by all worker threads: at most n calls per `per` seconds.
+    Callers only block once the window is full."""
+
+    def __init__(self, n, per):
+        self.n = n
+        self.per = per
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.calls and now - self.calls[0] >= self.per:
+                self.calls.popleft()
+            if len(self.calls) >= self.n:
+                time.sleep(self.per - (now - self.calls[0]))
+                self.calls.popleft()
+            self.calls.append(time.monotonic())
+
+
+# ---------- Disk cache ----------
+class DiskCache:
+    """In-memory dict backed by one namespace of a sqlite file, so TMDB
+    responses survive between runs. Entries older than ttl (seconds) are
+    fetched again; ttl=None keeps them forever. Negative (null) entries
+    expire after NEGATIVE_TTL at the latest. Expired entries that came
+    with an ETag/Last-Modified are kept aside for a conditional GET."""
+
+    def __init__(self, db: sqlite3.Connection, name: str, ttl=None):
+        self.db = db
+        self.name = name
+        self.data = {}
+        self.stale = {}
+        now = time.time()
+        cutoff = now - ttl if ttl else 0
+        negative_cutoff = max(cutoff, now - NEGATIVE_TTL)
+        rows = db.execute(
+            "SELECT key, json, fetched_at, etag, last_modified FROM cache WHERE name = ?", (name,))
+        for key, blob, fetched_at, etag, last_modified in rows:
+            if blob == "null":
+                if fetched_at >= negative_cutoff:
+                    self.data[key] = None
+            elif fetched_at >= cutoff:
+                self.data[key] = json_loads(blob)
+            elif etag or last_modified:
+                self.stale[key] = (blob, etag, last_modified)
+
+    @staticmethod
+    def _k(key):
+        return json.dumps(key)
+
+    def __contains__(self, key):
+        return self._k(key) in self.data
+
+    def __getitem__(self, key):
+        return self.data[self._k(key)]
+
+    def get(self, key, default=None):
+        return self.data.get(self._k(key), default)
+
+    def put(self, key, value, persist=True, etag=None, last_modified=None):
+        """Store value; with persist=False it is only kept for this run."""
+        k = self._k(key)
+        self.data[k] = value
+        self.stale.pop(k, None)
+        if persist:
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache (name, key, json, fetched_at, etag, last_modified)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (self.name, k, json.dumps(value), int(time.time()), etag, last_modified),
+            )
+            self.db.commit()
+
+    def validators(self, key):
+        """(etag, last_modified) of an expired entry, or None."""
+        entry = self.stale.get(self._k(key))
+        return entry[1:] if entry else None
+
+    def revalidate(self, key):
+        """The server answered 304: reuse the expired entry and restart its ttl."""
+        k = self._k(key)
+        if k in self.data:
+            return self.data[k]
+        blob, etag, last_modified = self.stale[k]
+        value = json_loads(blob)
+        self.put(key, value, etag=etag, last_modified=last_modified)
+        return value
+
+    __setitem__ = put
+
+
+def pick_translation(details, lang):
+    """Return the `data` block of the translation matching lang (e.g. de-DE)
+    from a response fetched with append_to_response=translations, or None."""
+    translations = ((details or {}).get("translations") or {}).get("translations")
+    if translations is None:
+        return None
+    iso_639, _, iso_3166 = lang.partition("-")
+    matches = [t for t in translations if t.get("iso_639_1") == iso_639]
+    for t in matches:
+        if t.get("iso_3166_1") == iso_3166:
+            return t.get("data") or {}
+    return (matches[0].get("data") or {}) if matches else None
+
+
+def load_image_config(session, path: Path, refresh=False):
+    """TMDB image settings from the cached /configuration response; the endpoint
+    is only called when the copy is missing, older than 30 days or refresh is set."""
+    try:
+        cached = json_loads(path.read_bytes())
+        age = time.time() - path.stat().st_mtime
+    except (OSError, ValueError):
+        cached = None  # missing, truncated or corrupt: treat as not cached
+    if cached and not refresh and age < IMAGE_CONFIG_MAX_AGE:
+        return cached
+    try:
+        r = session.get("https://api.themoviedb.org/3/configuration")
+        images = response_json(r)["images"] if r.status_code == 200 else None
+    except (requests.RequestException, ValueError, KeyError, TypeError):
+        images = None
+    if not images:
+        return cached or DEFAULT_IMAGE_CONFIG
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(images), encoding="utf-8")
+    return images
+
+
+def open_cache_db(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("""CREATE TABLE IF NOT EXISTS cache (
+        name TEXT, key TEXT, json TEXT, fetched_at INTEGER,
+        etag TEXT, last_modified TEXT,
+        PRIMARY KEY (name, key))""")
+    for column in ("etag", "last_modified"):
+        try:  # caches written before conditional GETs
+            db.execute(f"ALTER TABLE cache ADD COLUMN {column} TEXT")
+        except sqlite3.OperationalError:
+            pass
+    return db
 
 
 # ---------- Main ----------
@@ -36,8 +232,17 @@ def main():
     ap.add_argument("--outdir", default="enriched", help="Output directory")
     ap.add_argument("--tmdb-key", default=os.environ.get("TMDB_API_KEY"),
                     help="TMDB API key (or set TMDB_API_KEY)")
-    ap.add_argument("--sleep", type=float, default=0.02, help="Sleep between API calls (seconds)")
+    ap.add_argument("--rate-limit", type=int, default=35,
+                    help="Max TMDB requests per 10 seconds (TMDB allows ~40)")
+    # Deprecated: pacing is done by --rate-limit; still accepted so old invocations work
+    ap.add_argument("--sleep", type=float, help=argparse.SUPPRESS)
     ap.add_argument("--lang", default="de-DE", help="Preferred language for localized titles")
+    ap.add_argument("--workers", type=int, default=8, help="Parallel TMDB requests")
+    ap.add_argument("--cache-ttl-days", type=float, default=30,
+                    help="Refetch cached TMDB details older than this (localized titles are kept)")
+    ap.add_argument("--refresh-config", action="store_true",
+                    help="Fetch TMDB /configuration even if the cached copy is recent")
+    ap.add_argument("--force", action="store_true", help="Re-enrich records that are already complete")
     ap.add_argument("--debug", action="store_true", help="Print debug info for missing fields")
     args = ap.parse_args()
 
@@ -45,112 +250,288 @@ def main():
         print("ERROR: TMDB API key missing. Set TMDB_API_KEY or pass --tmdb-key.", file=sys.stderr)
         sys.exit(1)
 
-    # Sessions
+    # Sessions (pooled keep-alive connections; 429/5xx are retried with backoff).
+    # One connection per worker, blocking instead of opening throwaway extras.
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=args.workers, pool_block=True,
+                          max_retries=retry)
+
     s = requests.Session()
     s.params = {"api_key": args.tmdb_key}
-    s.headers.update({"Accept": "application/json"})
+    s.headers.update({"Accept": "application/json", "Connection": "keep-alive"})
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+
+    trakt_client_id = os.environ.get("TRAKT_CLIENT_ID")
+    ts = requests.Session()
+    ts.headers.update({
+        "trakt-api-version": "2",
+        "trakt-api-key": trakt_client_id or "",
+        "Accept": "application/json",
+    })
+    ts.mount("https://", adapter)
+
+    cache_dir = Path(args.outdir) / ".tmdb_cache"
 
     # TMDB configuration
-    cfg = s.get("https://api.themoviedb.org/3/configuration").json()
-    base = cfg["images"]["secure_base_url"]
-    poster_size = "w500" if "w500" in cfg["images"]["poster_sizes"] else cfg["images"]["poster_sizes"][-1]
-    backdrop_size = "w780" if "w780" in cfg["images"]["backdrop_sizes"] else cfg["images"]["backdrop_sizes"][-1]
-    still_size = "w300" if "w300" in cfg["images"]["still_sizes"] else cfg["images"]["still_sizes"][-1]
+    images = load_image_config(s, cache_dir / "tmdb_config.json", refresh=args.refresh_config)
+    base = images["secure_base_url"]
+    poster_size = "w500" if "w500" in images["poster_sizes"] else images["poster_sizes"][-1]
+    backdrop_size = "w780" if "w780" in images["backdrop_sizes"] else images["backdrop_sizes"][-1]
+    still_size = "w300" if "w300" in images["still_sizes"] else images["still_sizes"][-1]
 
     def build_url(path, size):
         return f"{base}{size}{path}" if path else None
 
-    # caches
-    find_cache = {}
-    movie_def_cache = {}
-    movie_de_cache = {}
-    tv_def_cache = {}
-    tv_de_cache = {}
-    tv_external_ids_cache = {}
-    season_de_cache = {}
-    episode_cache_de = {}
-    episode_cache_def = {}
-    trakt_show_ids_cache = {}
-
-    def pause():
-        time.sleep(args.sleep)
+    # caches (persisted under <outdir>/.tmdb_cache between runs)
+    cache_db = open_cache_db(cache_dir / "tmdb.sqlite")
+    ttl = args.cache_ttl_days * 86400
+    find_cache = DiskCache(cache_db, "find", ttl)
+    movie_def_cache = DiskCache(cache_db, "movie_def", ttl)
+    movie_de_cache = DiskCache(cache_db, "movie_de")
+    tv_def_cache = DiskCache(cache_db, "tv_def", ttl)
+    tv_de_cache = DiskCache(cache_db, "tv_de")
+    tv_external_ids_cache = DiskCache(cache_db, "tv_external_ids", ttl)
+    season_de_cache = DiskCache(cache_db, "season_de", ttl)
+    season_def_cache = DiskCache(cache_db, "season_def", ttl)
+    episode_cache_de = DiskCache(cache_db, "episode_de")
+    episode_cache_def = DiskCache(cache_db, "episode_def")
+    trakt_show_ids_cache = DiskCache(cache_db, "trakt_show_ids", ttl)
+    cache_lock = threading.Lock()
+
+    bucket = RateLimiter(args.rate_limit, 10.0)
+
+    def cached_get(cache, key, url, params=None, default=None, empty=None):
+        """GET through cache. A 404, or a 200 for which empty(json) is true, is
+        stored as a negative entry; callers get default for those and for errors."""
+        with cache_lock:
+            if key in cache:
+                val = cache[key]
+                return default if val is None else val
+            validators = cache.validators(key)
+        headers = {}
+        if validators:
+            etag, last_modified = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        bucket.take()
+        try:
+            r = s.get(url, params=params, headers=headers or None)
+            if r.status_code == 304:
+                with cache_lock:
+                    return cache.revalidate(key)
+            val = response_json(r) if r.status_code == 200 else None
+        except (requests.RequestException, ValueError):
+            return default  # not cached, retried on the next run
+        if val is not None and empty and empty(val):
+            val = None
+        with cache_lock:
+            if val is not None:
+                cache.put(key, val, etag=r.headers.get("ETag"),
+                          last_modified=r.headers.get("Last-Modified"))
+            else:
+                cache.put(key, None, persist=r.status_code in (200, 404))
+        return default if val is None else val
+
+    ex = ThreadPoolExecutor(max_workers=args.workers)
+
+    def prefetch(*batches):
+        """Run fn(*key) for every key of every (fn, keys) batch on the pool and wait;
+        results land in the caches. Independent batches share one round so their
+        requests overlap instead of queueing behind each other."""
+        futures = [ex.submit(fn, *k) for fn, keys in batches for k in keys]
+        for f in as_completed(futures):
+            f.result()
 
     # ---- helpers ----
     def find_by_imdb(imdb_id):
         if not imdb_id:
             return {}
-        if imdb_id in find_cache:
-            return find_cache[imdb_id]
-        r = s.get(f"https://api.themoviedb.org/3/find/{imdb_id}",
-                  params={"external_source": "imdb_id"})
-        find_cache[imdb_id] = r.json() if r.status_code == 200 else {}
-        return find_cache[imdb_id]
+        return cached_get(find_cache, imdb_id,
+                          f"https://api.themoviedb.org/3/find/{imdb_id}",
+                          params={"external_source": "imdb_id"}, default={},
+                          empty=lambda j: not any(j.get(f) for f in ("movie_results", "tv_results")))
+
+    def resolve_tmdb_id(imdb_id, kind):
+        """TMDB id for an IMDb id from the shared /find cache; kind is "movie" or "tv"."""
+        res = find_by_imdb(imdb_id).get(f"{kind}_results") or []
+        return res[0]["id"] if res else None
 
     def tv_external_ids(tv_id):
         if not tv_id:
             return {}
-        if tv_id in tv_external_ids_cache:
-            return tv_external_ids_cache[tv_id]
-        r = s.get(f"https://api.themoviedb.org/3/tv/{tv_id}/external_ids")
-        tv_external_ids_cache[tv_id] = r.json() if r.status_code == 200 else {}
-        pause()
-        return tv_external_ids_cache[tv_id]
+        ids = (tv_def_cache.get(tv_id) or {}).get("external_ids")
+        if ids is not None:
+            return ids
+        return cached_get(tv_external_ids_cache, tv_id,
+                          f"https://api.themoviedb.org/3/tv/{tv_id}/external_ids", default={},
+                          empty=lambda j: not (j.get("imdb_id") or j.get("tvdb_id")))
 
     def trakt_show_ids(trakt_id=None, slug=None):
-        client_id = os.environ.get("TRAKT_CLIENT_ID")
-        if not client_id:
+        if not trakt_client_id:
             return {}
         key = ("id", trakt_id) if trakt_id else ("slug", slug)
-        if key in trakt_show_ids_cache:
-            return trakt_show_ids_cache[key]
-        headers = {
-            "trakt-api-version": "2",
-            "trakt-api-key": client_id,
-            "Accept": "application/json",
-        }
+        with cache_lock:
+            if key in trakt_show_ids_cache:
+                return trakt_show_ids_cache[key] or {}
         if trakt_id:
             url = f"https://api.trakt.tv/shows/{trakt_id}?extended=ids"
         elif slug:
             url = f"https://api.trakt.tv/shows/{slug}?extended=ids"
         else:
             return {}
+        out, persist = None, False
         try:
-            r = requests.get(url, headers=headers, timeout=20)
-            if r.status_code != 200:
-                trakt_show_ids_cache[key] = {}
-                return {}
-            j = r.json() or {}
-            ids = (j.get("ids") or {})
-            out = {"imdb": ids.get("imdb"), "tvdb": ids.get("tvdb")}
-            trakt_show_ids_cache[key] = out
-            return out
+            r = ts.get(url, timeout=20)
+            if r.status_code == 200:
+                ids = ((response_json(r) or {}).get("ids") or {})
+                if ids.get("imdb") or ids.get("tvdb"):
+                    out = {"imdb": ids.get("imdb"), "tvdb": ids.get("tvdb")}
+            persist = r.status_code in (200, 404)
         except Exception:
-            trakt_show_ids_cache[key] = {}
-            return {}
+            pass
+        with cache_lock:
+            trakt_show_ids_cache.put(key, out, persist=persist)
+        return out or {}
+
+    def movie_details(mid, lang=None):
+        if lang:
+            # Served from the translations appended to the default response when possible
+            j_def = movie_def_cache.get(mid) or {}
+            tr = pick_translation(j_def, lang)
+            if tr is not None:
+                return {"title": tr.get("title") or j_def.get("title"), "overview": tr.get("overview")}
+            return cached_get(movie_de_cache, (mid, lang),
+                              f"https://api.themoviedb.org/3/movie/{mid}", params={"language": lang})
+        return cached_get(movie_def_cache, mid, f"https://api.themoviedb.org/3/movie/{mid}",
+                          params={"append_to_response": "translations,external_ids"})
+
+    def resolve_movie_id(m):
+        return m.get("tmdb") or resolve_tmdb_id(m.get("imdb"), "movie")
+
+    def resolve_tv_id(tv_id=None, imdb_id=None):
+        return tv_id or resolve_tmdb_id(imdb_id, "tv")
+
+    def tv_details(tid):
+        return cached_get(tv_def_cache, tid, f"https://api.themoviedb.org/3/tv/{tid}",
+                          params={"append_to_response": "external_ids,translations"})
+
+    def tv_details_default(tv_id=None, imdb_id=None):
+        tid = resolve_tv_id(tv_id, imdb_id)
+        if not tid:
+            return None, None
+        return tid, tv_details(tid)
+
+    def tv_details_localized(tv_id, lang):
+        tv_def = tv_def_cache.get(tv_id) or {}
+        tr = pick_translation(tv_def, lang)
+        if tr is not None:
+            return {"name": tr.get("name") or tv_def.get("name"),
+                    "poster_path": tv_def.get("poster_path"),
+                    "backdrop_path": tv_def.get("backdrop_path")}
+        return cached_get(tv_de_cache, (tv_id, lang),
+                          f"https://api.themoviedb.org/3/tv/{tv_id}", params={"language": lang})
+
+    def season_details_localized(tv_id, season, lang):
+        return cached_get(season_de_cache, (tv_id, season, lang),
+                          f"https://api.themoviedb.org/3/tv/{tv_id}/season/{season}",
+                          params={"language": lang})
+
+    def season_details_default(tv_id, season):
+        return cached_get(season_def_cache, (tv_id, season),
+                          f"https://api.themoviedb.org/3/tv/{tv_id}/season/{season}")
+
+    def episode_from_season(season_json, ep):
+        for item in (season_json or {}).get("episodes") or []:
+            if item.get("episode_number") == ep:
+                return item
+        return None
+
+    # Episodes are normally taken from the season payloads (one call per season
+    # instead of one per episode); the episode endpoint is only a fallback.
+    def episode_details_def(tv_id, season, ep):
+        found = episode_from_season(season_def_cache.get((tv_id, season)), ep)
+        if found is not None:
+            return found
+        return cached_get(episode_cache_def, (tv_id, season, ep),
+                          f"https://api.themoviedb.org/3/tv/{tv_id}/season/{season}/episode/{ep}")
+
+    def episode_details_de(tv_id, season, ep, lang):
+        found = episode_from_season(season_de_cache.get((tv_id, season, lang)), ep)
+        if found is not None:
+            return found
+        return cached_get(episode_cache_de, (tv_id, season, ep, lang),
+                          f"https://api.themoviedb.org/3/tv/{tv_id}/season/{season}/episode/{ep}",
+                          params={"language": lang})
+
+    def incomplete(rec, fields):
+        return args.force or not all(rec.get(k) for k in fields)
 
-    # ---------------- Movies ----------------
     movies = load_yaml(Path(args.movies))
-    for m in movies:
-        mid = m.get("tmdb")
-        if not mid and m.get("imdb"):
-            res = find_by_imdb(m["imdb"]).get("movie_results") or []
-            if res:
-                mid = res[0]["id"]
-        if not mid:
+    episodes = load_yaml(Path(args.episodes))
+    # Records are enriched in place, so only the incomplete ones need work.
+    movies_todo = [m for m in movies if incomplete(m, MOVIE_FIELDS)]
+    episodes_todo = [e for e in episodes if incomplete(e, EPISODE_FIELDS)]
+
+    # ---------------- Prefetch ----------------
+    # All network work happens here, in rounds that only wait where one lookup
+    # needs another's result; the loops below just read from the caches.
+
+    # One /find batch for every IMDb id lacking a TMDB id; the response holds
+    # both movie_results and tv_results, so movies and shows share it.
+    needed_imdb = {x["imdb"] for x in movies_todo + episodes_todo if not x.get("tmdb") and x.get("imdb")}
+    prefetch((find_by_imdb, [(imdb,) for imdb in needed_imdb]))
+
+    movie_ids = {resolve_movie_id(m) for m in movies_todo} - {None}
+    ep_tv_ids = [resolve_tv_id(e.get("tmdb"), e.get("imdb")) for e in episodes_todo]
+    tv_ids = {tid for tid in ep_tv_ids if tid}
+    seasons, eps = set(), set()
+    for tid, e in zip(ep_tv_ids, episodes_todo):
+        sn, en = e.get("season"), e.get("episode")
+        if not tid or sn is None or not incomplete(e, EPISODE_DETAIL_FIELDS):
+            continue
+        seasons.add((tid, int(sn)))
+        if en is not None:
+            eps.add((tid, int(sn), int(en)))
+
+    # Details (with appended translations/external ids) and season lists.
+    prefetch(
+        (movie_details, [(mid,) for mid in movie_ids]),
+        (tv_details, [(tid,) for tid in tv_ids]),
+        (season_details_localized, [k + (args.lang,) for k in seasons]),
+        (season_details_default, seasons),
+    )
+    # Mostly served from the responses above; only gaps go to the network.
+    prefetch(
+        (movie_details, [(mid, args.lang) for mid in movie_ids]),
+        (tv_details_localized, [(tid, args.lang) for tid in tv_ids]),
+        (tv_external_ids, [(tid,) for tid in tv_ids]),
+        (episode_details_def, eps),
+        (episode_details_de, [k + (args.lang,) for k in eps]),
+    )
+
+    # Trakt fallback for shows where TMDB has no imdb/tvdb id.
+    needed_trakt = {}
+    for tid, e in zip(ep_tv_ids, episodes_todo):
+        if not tid:
             continue
+        ex_ids = tv_external_ids(tid)
+        if not (e.get("imdb") or ex_ids.get("imdb_id")) or not (e.get("tvdb") or ex_ids.get("tvdb_id")):
+            trakt_id, slug = e.get("trakt_show"), e.get("slug")
+            needed_trakt.setdefault(trakt_id or slug, (trakt_id, slug))
+    prefetch((trakt_show_ids, needed_trakt.values()))
 
-        if mid not in movie_def_cache:
-            r_def = s.get(f"https://api.themoviedb.org/3/movie/{mid}")
-            movie_def_cache[mid] = r_def.json() if r_def.status_code == 200 else None
-            pause()
-        j_def = movie_def_cache.get(mid) or {}
+    # ---------------- Movies ----------------
+    for m in movies_todo:
+        mid = resolve_movie_id(m)
+        if not mid:
+            continue
 
-        if mid not in movie_de_cache:
-            r_de = s.get(f"https://api.themoviedb.org/3/movie/{mid}",
-                         params={"language": args.lang})
-            movie_de_cache[mid] = r_de.json() if r_de.status_code == 200 else None
-            pause()
-        j_de = movie_de_cache.get(mid) or {}
+        j_def = movie_details(mid) or {}
+        j_de = movie_details(mid, args.lang) or {}
 
         m["tmdb"] = mid
         m["poster"] = build_url(j_def.get("poster_path"), poster_size) or m.get("poster")
@@ -168,59 +549,9 @@ def main():
                   f"imdb={m.get('imdb')}, poster={m.get('poster')}")
 
     # ---------------- Episodes / TV ----------------
-    episodes = load_yaml(Path(args.episodes))
     show_meta_cache = {}
 
-    def tv_details_default(tv_id=None, imdb_id=None):
-        tid = tv_id
-        if not tid and imdb_id:
-            res = find_by_imdb(imdb_id).get("tv_results") or []
-            if res:
-                tid = res[0]["id"]
-        if not tid:
-            return None, None
-        if tid not in tv_def_cache:
-            r = s.get(f"https://api.themoviedb.org/3/tv/{tid}")
-            tv_def_cache[tid] = r.json() if r.status_code == 200 else None
-            pause()
-        return tid, tv_def_cache.get(tid)
-
-    def tv_details_localized(tv_id, lang):
-        key = (tv_id, lang)
-        if key not in tv_de_cache:
-            r = s.get(f"https://api.themoviedb.org/3/tv/{tv_id}",
-                      params={"language": lang})
-            tv_de_cache[key] = r.json() if r.status_code == 200 else None
-            pause()
-        return tv_de_cache.get(key)
-
-    def season_details_localized(tv_id, season, lang):
-        key = (tv_id, season, lang)
-        if key not in season_de_cache:
-            r = s.get(f"https://api.themoviedb.org/3/tv/{tv_id}/season/{season}",
-                      params={"language": lang})
-            season_de_cache[key] = r.json() if r.status_code == 200 else None
-            pause()
-        return season_de_cache.get(key)
-
-    def episode_details_def(tv_id, season, ep):
-        key = (tv_id, season, ep)
-        if key not in episode_cache_def:
-            r = s.get(f"https://api.themoviedb.org/3/tv/{tv_id}/season/{season}/episode/{ep}")
-            episode_cache_def[key] = r.json() if r.status_code == 200 else None
-            pause()
-        return episode_cache_def.get(key)
-
-    def episode_details_de(tv_id, season, ep, lang):
-        key = (tv_id, season, ep, lang)
-        if key not in episode_cache_de:
-            r = s.get(f"https://api.themoviedb.org/3/tv/{tv_id}/season/{season}/episode/{ep}",
-                      params={"language": lang})
-            episode_cache_de[key] = r.json() if r.status_code == 200 else None
-            pause()
-        return episode_cache_de.get(key)
-
-    for e in episodes:
+    for e in episodes_todo:
         tv_id, tv_def = tv_details_default(tv_id=e.get("tmdb"), imdb_id=e.get("imdb"))
         e["tmdb"] = tv_id or e.get("tmdb")
 
@@ -229,7 +560,7 @@ def main():
                 tv_de = tv_details_localized(tv_id, args.lang)
                 total_eps = tv_def.get("number_of_episodes") if tv_def else None
                 run_times = (tv_def.get("episode_run_time") or []) if tv_def else []
-                avg_rt = int(round(statistics.mean(run_times))) if run_times else None
+                avg_rt = round(sum(run_times) / len(run_times)) if run_times else None
                 poster_path = (tv_def or {}).get("poster_path") or (tv_de or {}).get("poster_path")
                 backdrop_path = (tv_def or {}).get("backdrop_path") or (tv_de or {}).get("backdrop_path")
 
@@ -271,14 +602,14 @@ def main():
 
             sn = e.get("season")
             en = e.get("episode")
-            if sn is not None:
+            if sn is not None and incomplete(e, ("season_total_episodes",)):
                 s_de = season_details_localized(tv_id, int(sn), args.lang)
                 if s_de and "episodes" in s_de:
                     e["season_total_episodes"] = len(s_de["episodes"])
                 else:
                     e.setdefault("season_total_episodes", None)
 
-            if sn is not None and en is not None:
+            if sn is not None and en is not None and incomplete(e, EPISODE_DETAIL_FIELDS[1:]):
                 ed_de = episode_details_de(tv_id, int(sn), int(en), args.lang)
                 ed_def = episode_details_def(tv_id, int(sn), int(en))
 
@@ -298,6 +629,11 @@ def main():
                   f"imdb={e.get('imdb')}, tvdb={e.get('tvdb')}, "
                   f"ep_title_de={e.get('episode_title_de')}")
 
+    ex.shutdown()
+    s.close()
+    ts.close()
+    cache_db.close()
+
     # ---------- Write output ----------
     outdir = Path(args.outdir)
     dump_yaml(outdir / "watched_movies.yml", movies)
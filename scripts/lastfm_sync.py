@@ -21,31 +21,73 @@ Beispiele:
 """
 
 import os
+import re
+import json
+import hashlib
 import sys
 import time
-import glob
 import argparse
+import itertools
+import operator
 import pathlib
 import datetime
-from collections import defaultdict
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:  # C-Loader/-Dumper von libyaml, falls PyYAML damit gebaut ist
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+    print("[WARN] libyaml nicht verfügbar – YAML läuft über den langsamen Python-Parser.", file=sys.stderr)
 
 API_ROOT = "https://ws.audioscrobbler.com/2.0/"
 DATA_DIR = pathlib.Path("_data/lastfm")
+CURSOR_FILE = DATA_DIR / ".lastfm_cursor"   # uts des neuesten gespeicherten Scrobbles
+PAGE_CACHE_DIR = pathlib.Path(".lastfm_cache")  # lokal (Backfills), bewusst außerhalb von _data
 
 PAGE_LIMIT = 200                 # max laut Last.fm
-REQUEST_SLEEP_SEC = 0.3          # sanftes Paging
+REQUEST_SLEEP_SEC = 0.3          # Mindestabstand zwischen Request-Starts
+PAGE_WORKERS = 4                 # parallele Seitenabrufe
 MAX_RETRIES = 5                  # Retries für Netz-/HTTP-Fehler
 RETRY_BACKOFF_BASE = 1.5         # Exponential Backoff
 
+# Eine Session für alle Seiten: Keep-Alive statt neuem TLS-Handshake pro Request
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=PAGE_WORKERS))
+
+_throttle_lock = threading.Lock()
+_next_request_at = 0.0
+
+def throttle():
+    # Verteilt Request-Starts threadübergreifend im Abstand von REQUEST_SLEEP_SEC
+    global _next_request_at
+    with _throttle_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + REQUEST_SLEEP_SEC
+    if wait > 0:
+        time.sleep(wait)
+
 def ensure_data_dir():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 def iso_from_uts(uts: int) -> str:
-    return datetime.datetime.utcfromtimestamp(uts).isoformat(timespec="seconds") + "Z"
+    # Einmal pro Scrobble: gmtime/strftime statt datetime-Objekten
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(uts))
+
+def uts_from_iso(iso_utc: str) -> int:
+    dt = datetime.datetime.fromisoformat(iso_utc.replace("Z", ""))
+    return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
 
 def year_month_from_iso(iso_utc: str):
     return iso_utc[:4], iso_utc[5:7]  # YYYY, MM
@@ -54,68 +96,135 @@ def load_yaml(path: pathlib.Path):
     if not path.exists():
         return []
     try:
-        data = yaml.safe_load(path.read_text(encoding="utf-8"))
+        data = yaml.load(path.read_bytes(), Loader=SafeLoader)  # libyaml dekodiert UTF-8 selbst
         return data or []
     except Exception as e:
         print(f"[WARN] YAML konnte nicht gelesen werden: {path} – {e}", file=sys.stderr)
         return []
 
-def save_yaml(path: pathlib.Path, rows):
+def write_atomic(path: pathlib.Path, data: bytes):
+    # Erst in eine Nachbardatei, dann os.replace: ein abgebrochener Lauf hinterlässt
+    # nie einen halb geschriebenen Monat. Kein fsync pro Datei – das übernimmt das OS.
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+ROW_START_RE = re.compile(r"^(?=- )", re.M)
+
+def dump_row(row: dict) -> str:
+    # Ein-Element-Liste → Text identisch zum Abschnitt im Dump der ganzen Liste
+    return yaml.dump([row], Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+
+# Sortierschlüssel (key= wird ohnehin nur einmal je Element berechnet;
+# itemgetter spart dabei den Python-Frame des Lambdas)
+played_at_key = operator.itemgetter("played_at_utc")
+
+def save_yaml(path: pathlib.Path, rows, keep: int = 0):
+    # Die ersten `keep` rows stehen unverändert in der Datei: deren Text wird
+    # übernommen, serialisiert werden nur die übrigen.
     path.parent.mkdir(parents=True, exist_ok=True)
-    rows_sorted = sorted(rows, key=lambda x: x["played_at_utc"], reverse=True)
-    txt = yaml.safe_dump(rows_sorted, allow_unicode=True, sort_keys=False)
-    path.write_text(txt, encoding="utf-8")
+    chunks = ROW_START_RE.split(path.read_text(encoding="utf-8"))[1:] if keep else []
+    if len(chunks) != keep:
+        chunks = []
+    pairs = list(zip(rows, chunks)) + [(r, dump_row(r)) for r in rows[len(chunks):]]
+    pairs.sort(key=lambda p: p[0]["played_at_utc"], reverse=True)
+    write_atomic(path, "".join(c for _, c in pairs).encode("utf-8"))
+
+def prepend_yaml(path: pathlib.Path, rows):
+    # rows sind alle neuer als der Dateianfang: vorn einfügen, statt den
+    # ganzen Monat neu zu parsen, sortieren und serialisieren
+    rows_sorted = sorted(rows, key=played_at_key, reverse=True)
+    txt = "".join(map(dump_row, rows_sorted))
+    write_atomic(path, txt.encode("utf-8") + path.read_bytes())
+
+def row_key(row: dict) -> tuple:
+    # Strenger Key: Zeit + Artist + Track + Album; .get, weil ältere Zeilen
+    # ohne Album/Artist nicht mit KeyError abbrechen dürfen
+    return (row.get("played_at_utc"), row.get("artist"), row.get("track"), row.get("album"))
 
 def dedupe_merge(existing, new_items):
-    # Strenger Key: Zeit + Artist + Track + Album
-    def k(e):
-        return (e.get("played_at_utc"), e.get("artist"), e.get("track"), e.get("album"))
-    seen = {k(e) for e in existing}
-    merged = existing[:]
+    seen = set(map(row_key, existing))
+    extra = []
     for e in new_items:
-        if k(e) not in seen:
-            merged.append(e)
-            seen.add(k(e))
-    return merged
+        k = row_key(e)
+        if k not in seen:
+            seen.add(k)
+            extra.append(e)
+    return existing + extra
+
+PLAYED_AT_RE = re.compile(r"""^(?:- |  )played_at_utc: ['"]?(\d{4}-\d\d-\d\dT[\d:]+Z)""")
+
+def first_played_at(path: pathlib.Path) -> Optional[str]:
+    # save_yaml schreibt neueste zuerst → der erste Treffer ist der neueste;
+    # die Datei wird nur bis dahin gelesen statt komplett geparst.
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            m = PLAYED_AT_RE.match(line)
+            if m:
+                return m.group(1)
+    return None
+
+def month_files_newest_first():
+    # YYYY/MM.yml sortiert lexikographisch chronologisch; scandir liefert den
+    # Typ ohne extra stat(), und ältere Jahre werden erst bei Bedarf gelistet.
+    try:
+        with os.scandir(DATA_DIR) as it:
+            years = sorted((e.path for e in it if e.is_dir() and e.name.isdigit()), reverse=True)
+    except FileNotFoundError:
+        return
+    for ypath in years:
+        with os.scandir(ypath) as it:
+            months = sorted((e.path for e in it if e.is_file() and e.name.endswith(".yml")), reverse=True)
+        for mpath in months:
+            yield pathlib.Path(mpath)
 
 def newest_uts_from_files() -> Optional[int]:
-    newest = None
-    for path_str in glob.glob(str(DATA_DIR / "*" / "*.yml")):
-        rows = load_yaml(pathlib.Path(path_str))
-        for r in rows or []:
-            ts = r.get("played_at_utc")
-            if not ts:
-                continue
-            try:
-                dt = datetime.datetime.fromisoformat(ts.replace("Z", ""))
-                uts = int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
-                if newest is None or uts > newest:
-                    newest = uts
-            except Exception:
-                continue
-    return newest
+    # Ältere Monate werden nur gelesen, wenn die neueren leer sind.
+    for path in month_files_newest_first():
+        ts = first_played_at(path)
+        if ts:
+            return uts_from_iso(ts)
+    return None
 
-def largest_image_url(images: list) -> Optional[str]:
-    if not images:
+def read_cursor() -> Optional[int]:
+    try:
+        return int(CURSOR_FILE.read_text(encoding="utf-8").strip())
+    except (FileNotFoundError, ValueError):
         return None
-    order = ["mega", "extralarge", "large", "medium", "small"]
-    by_size = {im.get("size"): (im.get("#text") or "").strip() for im in images}
-    for sz in order:
-        url = by_size.get(sz)
-        if url:
-            return url
-    for im in images:
-        u = (im.get("#text") or "").strip()
-        if u:
-            return u
-    return None
 
-def req_with_retries(params: dict, timeout=30):
+def update_cursor(uts: int):
+    # Nur vorwärts: ein Backfill alter Jahre darf den Cursor nicht zurücksetzen
+    current = read_cursor()
+    if current is None:
+        # Ohne Cursor mit dem neuesten Stand der Dateien starten, sonst würde ein
+        # erster Backfill den uts eines alten Jahres als Cursor hinterlassen
+        write_atomic(CURSOR_FILE, str(max(uts, newest_uts_from_files() or 0)).encode("utf-8"))
+    elif uts > current:
+        write_atomic(CURSOR_FILE, str(uts).encode("utf-8"))
+
+IMAGE_SIZE_PRIO = {"mega": 0, "extralarge": 1, "large": 2, "medium": 3, "small": 4}
+
+def largest_image_url(images: list) -> Optional[str]:
+    # Ein Durchlauf ohne Zwischen-Dict; unbekannte Größen nur als Fallback (erste gewinnt)
+    best_prio, best_url = 99, None
+    for im in images or ():
+        url = (im.get("#text") or "").strip()
+        if not url:
+            continue
+        prio = IMAGE_SIZE_PRIO.get(im.get("size"), 98)
+        if prio < best_prio:
+            best_prio, best_url = prio, url
+            if prio == 0:
+                break
+    return best_url
+
+def req_with_retries(params: dict, timeout=30, headers=None):
     attempt = 0
     while True:
         attempt += 1
         try:
-            r = requests.get(API_ROOT, params=params, timeout=timeout)
+            throttle()
+            r = SESSION.get(API_ROOT, params=params, timeout=timeout, headers=headers)
             if r.status_code == 429:
                 raise requests.HTTPError("429 Too Many Requests", response=r)
             return r
@@ -126,94 +235,156 @@ def req_with_retries(params: dict, timeout=30):
             print(f"[WARN] Request-Fehler (Versuch {attempt}/{MAX_RETRIES}): {e} → warte {sleep:.1f}s", file=sys.stderr)
             time.sleep(sleep)
 
+def response_json(r):
+    # orjson, falls installiert – deutlich schneller bei 200er-Seiten
+    return orjson.loads(r.content) if orjson else r.json()
+
+def page_cache_path(params: dict) -> pathlib.Path:
+    key = json.dumps({k: v for k, v in params.items() if k != "api_key"}, sort_keys=True)
+    return PAGE_CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+def fetch_page(params: dict, cacheable: bool = False) -> dict:
+    # Nur Seiten mit festem Zeitfenster (Backfill) sind stabil genug für den Cache;
+    # liegt eine Kopie mit ETag/Last-Modified vor, wird bedingt angefragt.
+    cache_path = page_cache_path(params) if cacheable else None
+    cached = None
+    if cache_path and cache_path.exists():
+        try:
+            raw = cache_path.read_bytes()
+            cached = orjson.loads(raw) if orjson else json.loads(raw)
+        except ValueError:
+            cached = None
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    r = req_with_retries(params, headers=headers or None)
+    if r.status_code == 304 and cached:
+        return cached["data"]
+    r.raise_for_status()
+    try:
+        data = response_json(r)
+    except (requests.RequestException, ValueError) as e:
+        raise RuntimeError(f"Last.fm Antwort nicht lesbar: {e}") from e
+    if isinstance(data, dict) and data.get("error"):
+        raise RuntimeError(f"Last.fm API Fehler: {data.get('message', data.get('error'))}")
+
+    etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    if cache_path and (etag or last_modified):
+        PAGE_CACHE_DIR.mkdir(exist_ok=True)
+        entry = {"etag": etag, "last_modified": last_modified, "data": data}
+        write_atomic(cache_path, json.dumps(entry).encode("utf-8"))
+    return data
+
+def tracks_to_rows(items: list) -> list[dict]:
+    batch = []
+    for t in items:
+        if t.get("@attr", {}).get("nowplaying") == "true":
+            continue
+        date = t.get("date") or {}
+        uts_str = date.get("uts")
+        if not uts_str:
+            continue
+        uts = int(uts_str)
+        played_at = iso_from_uts(uts)
+
+        artist_obj = t.get("artist") or {}
+        album_obj  = t.get("album") or {}
+        images     = t.get("image") or []
+        cover_url  = largest_image_url(images)
+
+        batch.append({
+            # extended=1 liefert den Namen unter "name", sonst unter "#text"
+            "artist": artist_obj.get("name") or artist_obj.get("#text"),
+            "track": t.get("name"),
+            "album": album_obj.get("#text") or None,
+            "played_at_utc": played_at,
+            "lastfm_url": t.get("url"),
+            # MBIDs direkt aus der Last.fm-Antwort:
+            "mbid_track": t.get("mbid") or None,
+            "mbid_artist": artist_obj.get("mbid") or None,
+            "mbid_album": album_obj.get("mbid") or None,
+            # Medien:
+            "cover_url": cover_url,
+            "loved": t.get("loved") == "1",
+            # Platzhalter für evtl. spätere Felder:
+            "duration_sec": None,
+            "source": "lastfm",
+        })
+    return batch
+
 def fetch_recent(user: str, api_key: str, from_uts: Optional[int], to_uts: Optional[int] = None) -> list[dict]:
-    page = 1
-    collected = []
     base = {
         "method": "user.getRecentTracks",
         "user": user,
         "api_key": api_key,
         "format": "json",
         "limit": str(PAGE_LIMIT),
+        "extended": "1",  # liefert "loved" im selben Request mit
     }
     if from_uts is not None:
         base["from"] = str(from_uts)
-    if to_uts is not None:
-        base["to"] = str(to_uts)
-
-    while True:
-        params = dict(base, page=str(page))
-        r = req_with_retries(params)
-        r.raise_for_status()
-        data = r.json()
-        if isinstance(data, dict) and data.get("error"):
-            raise RuntimeError(f"Last.fm API Fehler: {data.get('message', data.get('error'))}")
-
-        items = (data.get("recenttracks") or {}).get("track", []) or []
-        if not items:
-            break
-
-        batch = []
-        for t in items:
-            if t.get("@attr", {}).get("nowplaying") == "true":
-                continue
-            date = t.get("date") or {}
-            uts_str = date.get("uts")
-            if not uts_str:
-                continue
-            uts = int(uts_str)
-            played_at = iso_from_uts(uts)
-
-            artist_obj = t.get("artist") or {}
-            album_obj  = t.get("album") or {}
-            images     = t.get("image") or []
-            cover_url  = largest_image_url(images)
-
-            batch.append({
-                "artist": artist_obj.get("#text"),
-                "track": t.get("name"),
-                "album": album_obj.get("#text") or None,
-                "played_at_utc": played_at,
-                "lastfm_url": t.get("url"),
-                # MBIDs direkt aus der Last.fm-Antwort:
-                "mbid_track": t.get("mbid") or None,
-                "mbid_artist": artist_obj.get("mbid") or None,
-                "mbid_album": album_obj.get("mbid") or None,
-                # Medien:
-                "cover_url": cover_url,
-                # Platzhalter für evtl. spätere Felder:
-                "loved": False,
-                "duration_sec": None,
-                "source": "lastfm",
-            })
-        collected.extend(batch)
-
-        attr = (data.get("recenttracks") or {}).get("@attr", {}) or {}
-        total_pages = int(attr.get("totalPages", "1"))
-        if page >= total_pages:
-            break
-        page += 1
-        time.sleep(REQUEST_SLEEP_SEC)
-
-    collected.sort(key=lambda x: x["played_at_utc"], reverse=True)
+    # Offenes Fenster auf den Startzeitpunkt festnageln: kommt während des parallelen
+    # Abrufs ein Scrobble dazu, verschieben sich sonst alle Seiten um eine Zeile und
+    # an einer Seitengrenze kann ein Track verloren gehen
+    cacheable = to_uts is not None
+    base["to"] = str(to_uts if cacheable else int(time.time()))
+
+    # Seite 1 liefert totalPages, die restlichen Seiten laufen parallel
+    first = fetch_page(dict(base, page="1"), cacheable)
+    recent = first.get("recenttracks") or {}
+    items = recent.get("track", []) or []
+    collected = tracks_to_rows(items)
+    total_pages = int((recent.get("@attr", {}) or {}).get("totalPages", "1"))
+
+    if items and total_pages > 1:
+        with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as ex:
+            pages = ex.map(lambda p: fetch_page(dict(base, page=str(p)), cacheable),
+                           range(2, total_pages + 1))
+            for data in pages:
+                items = (data.get("recenttracks") or {}).get("track", []) or []
+                collected.extend(tracks_to_rows(items))
+
+    collected.sort(key=played_at_key, reverse=True)
     return collected
 
 def bucket_by_month(items: list[dict]) -> dict[tuple[str, str], list[dict]]:
-    buckets = defaultdict(list)
-    for e in items:
-        y, m = year_month_from_iso(e["played_at_utc"])
-        buckets[(y, m)].append(e)
-    return buckets
+    # items kommen aus fetch_recent bereits nach played_at_utc sortiert,
+    # jeder Monat ist also ein zusammenhängender Block
+    groups = itertools.groupby(items, key=lambda e: year_month_from_iso(e["played_at_utc"]))
+    return {ym: list(g) for ym, g in groups}
 
 def write_month_buckets(buckets: dict[tuple[str, str], list[dict]]):
     total_written = 0
+    newest = None
     for (y, m), items in buckets.items():
         path = DATA_DIR / y / f"{m}.yml"
+        top = max(e["played_at_utc"] for e in items)
+        if newest is None or top > newest:
+            newest = top
+        head = first_played_at(path) if path.exists() else None
+        if head and min(e["played_at_utc"] for e in items) > head:
+            # Üblicher inkrementeller Fall: nur neuere Scrobbles im laufenden Monat.
+            # Alle liegen nach dem Dateianfang, Dubletten kann es nur untereinander
+            # geben (z. B. aus verschobenen Seiten beim parallelen Abruf).
+            fresh = dedupe_merge([], items)
+            prepend_yaml(path, fresh)
+            total_written += len(fresh)
+            print(f"[OK] {y}/{m}: +{len(fresh)} (vorn eingefügt) → {path}")
+            continue
         existing = load_yaml(path)
         merged = dedupe_merge(existing, items)
-        save_yaml(path, merged)
-        total_written += len(items)
-        print(f"[OK] {y}/{m}: +{len(items)} (gesamt: {len(merged)}) → {path}")
+        added = len(merged) - len(existing)
+        if not added:
+            print(f"[OK] {y}/{m}: keine neuen Einträge – unverändert.")
+            continue
+        save_yaml(path, merged, keep=len(existing))
+        total_written += added
+        print(f"[OK] {y}/{m}: +{added} (gesamt: {len(merged)}) → {path}")
+    if newest:
+        update_cursor(uts_from_iso(newest))
     return total_written
 
 def backfill_year(user: str, api_key: str, year: int):
@@ -244,7 +415,9 @@ def parse_years_spec(spec: str) -> list[int]:
     return sorted(years)
 
 def incremental_since_latest(user: str, api_key: str):
-    latest = newest_uts_from_files()
+    latest = read_cursor()
+    if latest is None:
+        latest = newest_uts_from_files()  # einmalig, bis der Cursor existiert
     if latest is None:
         print("[INFO] Keine vorhandenen Monatsdateien – bitte zuerst jahresweise backfillen (--backfill-years).")
         return
@@ -9,12 +9,26 @@ Trakt → YAML Sync (strict prepend-only, ohne Backups)
 - Cursor = neuestes watched_on – 1s (Boundary-sicher)
 """
 
-import os, sys, json
+import os, sys, json, time, shutil, hashlib, functools, threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import requests, yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:  # libyaml (C) lädt und schreibt die großen watched_*.yml deutlich schneller
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+    print("[trakt-sync] Warn: libyaml nicht verfügbar – YAML läuft über den langsamen Python-Parser.")
 
 # -----------------------------
 # Pfade / Setup
@@ -31,11 +45,19 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 MOVIES_YAML   = OUTPUT_DIR / "watched_movies.yml"
 EPISODES_YAML = OUTPUT_DIR / "watched_episodes.yml"
 CURSOR_FILE   = REPO_ROOT / ".trakt_cursor"
+CURSOR_IDS    = REPO_ROOT / ".trakt_cursor_ids"   # History-IDs im Überlappungsfenster des Cursors
 TOKENS_OUT    = REPO_ROOT / ".trakt_tokens.json"
+TMDB_CACHE_DIR = REPO_ROOT / ".tmdb_cache"   # nicht versioniert, per actions/cache persistiert
+
+TMDB_CACHE_TTL        = 7 * 86400
+TMDB_CACHE_TTL_AIRING = 86400   # laufende Serien ändern sich (neue Folgen, Stills)
 
 TRAKT_BASE = "https://api.trakt.tv"
 TMDB_BASE  = "https://api.themoviedb.org/3"
 IMG_BASE   = "https://image.tmdb.org/t/p"
+POSTER_W500   = f"{IMG_BASE}/w500"
+BACKDROP_W780 = f"{IMG_BASE}/w780"
+STILL_W300    = f"{IMG_BASE}/w300"
 USER_AGENT = "trakt-yaml-sync/2.5-prepend-no-backup (+github actions)"
 
 TRAKT_CLIENT_ID     = os.environ.get("TRAKT_CLIENT_ID", "")
@@ -43,6 +65,9 @@ TRAKT_CLIENT_SECRET = os.environ.get("TRAKT_CLIENT_SECRET", "")
 TRAKT_ACCESS_TOKEN  = os.environ.get("TRAKT_ACCESS_TOKEN", "")
 TRAKT_REFRESH_TOKEN = os.environ.get("TRAKT_REFRESH_TOKEN", "")
 TMDB_API_KEY        = os.environ.get("TMDB_API_KEY", "")
+HISTORY_LIMIT       = int(os.environ.get("TRAKT_HISTORY_LIMIT", "200"))
+HISTORY_PAGES       = int(os.environ.get("TRAKT_HISTORY_PAGES", "5"))
+TMDB_WORKERS        = int(os.environ.get("TMDB_WORKERS", "8"))
 
 if not (TRAKT_CLIENT_ID and TRAKT_CLIENT_SECRET and TRAKT_REFRESH_TOKEN and TMDB_API_KEY):
     print("[trakt-sync] ERROR: Missing required env.", file=sys.stderr)
@@ -57,23 +82,82 @@ TRAKT_HEADERS = {
 if TRAKT_ACCESS_TOKEN:
     TRAKT_HEADERS["Authorization"] = f"Bearer {TRAKT_ACCESS_TOKEN}"
 
+def pooled_adapter() -> HTTPAdapter:
+    # Keep-Alive-Pool groß genug für die Enrichment-Threads; 429/5xx werden mit
+    # Backoff wiederholt (nur GET – der Token-Refresh per POST rotiert Tokens).
+    return HTTPAdapter(pool_connections=2, pool_maxsize=max(TMDB_WORKERS, 4),
+                       max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429,500,502,503,504],
+                                         allowed_methods=["GET"], raise_on_status=False))
+
 SESSION = requests.Session()
 SESSION.headers.update(TRAKT_HEADERS)
+SESSION.mount("https://", pooled_adapter())
+
+# Eigene Session für TMDB (ohne Trakt-Header/Bearer-Token); api_key hängt an jedem Request
+TMDB_SESSION = requests.Session()
+TMDB_SESSION.headers["User-Agent"] = USER_AGENT
+TMDB_SESSION.params = {"api_key": TMDB_API_KEY}
+TMDB_SESSION.mount("https://", pooled_adapter())
 
 # -----------------------------
 # Utils
 # -----------------------------
 def log(msg: str): print(f"[trakt-sync] {msg}")
 
-def yaml_load(path: Path) -> List[Dict[str, Any]]:
+def json_loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def response_json(r: requests.Response) -> Any:
+    # orjson, falls installiert – schneller bei großen History-Seiten
+    return orjson.loads(r.content) if orjson else r.json()
+
+def json_bytes(obj: Any, indent: bool = False) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+_RESOLVER = yaml.resolver.Resolver()
+_CONSTRUCTOR = yaml.constructor.SafeConstructor()
+
+def _scalar(ev: yaml.ScalarEvent) -> Any:
+    # Gleiche Typauflösung wie beim vollen Laden (int, null, Datum, str …)
+    tag = ev.tag if ev.tag not in (None, "!") else _RESOLVER.resolve(yaml.ScalarNode, ev.value, ev.implicit)
+    node = yaml.ScalarNode(tag, ev.value, style=ev.style)
+    return _CONSTRUCTOR.yaml_constructors.get(tag, SafeLoader.construct_undefined)(_CONSTRUCTOR, node)
+
+def yaml_scan_fields(path: Path, fields: Tuple[str, ...], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Liest aus einer YAML-Liste von Mappings nur die genannten Top-Level-Felder.
+       Läuft über den Event-Stream statt jedes Mapping komplett aufzubauen;
+       mit limit wird nach so vielen Einträgen abgebrochen (Rest bleibt ungelesen)."""
     if not path.exists():
         return []
+    rows, row, key, depth = [], None, None, 0
     try:
-        data = yaml.safe_load(path.read_text(encoding="utf-8"))
-        return data if isinstance(data, list) else []
+        with path.open("rb") as f:
+            for ev in yaml.parse(f, Loader=SafeLoader):
+                if isinstance(ev, yaml.CollectionStartEvent):
+                    depth += 1
+                    if depth == 2 and isinstance(ev, yaml.MappingStartEvent):
+                        row, key = {}, None
+                elif isinstance(ev, yaml.CollectionEndEvent):
+                    depth -= 1
+                    if depth == 1 and row is not None:
+                        rows.append(row); row = None
+                        if limit and len(rows) >= limit:
+                            break
+                    elif depth == 2:
+                        key = None  # verschachtelter Wert zu Ende
+                elif depth == 2 and row is not None and isinstance(ev, (yaml.ScalarEvent, yaml.AliasEvent)):
+                    if key is None:
+                        key = ev.value if isinstance(ev, yaml.ScalarEvent) else ""
+                    else:
+                        if key in fields and isinstance(ev, yaml.ScalarEvent):
+                            row[key] = _scalar(ev)
+                        key = None
     except Exception as e:
-        log(f"Warn: YAML load {path}: {e}")
+        log(f"Warn: YAML scan {path}: {e}")
         return []
+    return rows
 
 def parse_iso(s: str) -> Optional[datetime]:
     try:
@@ -88,61 +172,86 @@ def only_date(iso_ts: Optional[str]) -> Optional[str]:
         return None
     return iso_ts.split("T", 1)[0] if "T" in iso_ts else iso_ts
 
-def read_cursor_env_or_file() -> Optional[str]:
-    v = os.environ.get("TRAKT_START_AT_ISO", "").strip()
-    if v:
-        return v
-    if CURSOR_FILE.exists():
-        try:
-            txt = CURSOR_FILE.read_text(encoding="utf-8").strip()
-            return txt or None
-        except Exception:
-            return None
-    return None
+def write_atomic(path: Path, data: bytes):
+    # Erst Nachbardatei, dann os.replace → nie eine halb geschriebene Datei
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
 
 def latest_watched_iso_from_yaml() -> Optional[str]:
-    max_dt = None
+    # Prepend-only → der neueste Eintrag steht jeweils ganz oben; nur den ersten
+    # Eintrag je Datei lesen. (Wäre eine Datei doch unsortiert, startet der
+    # Fallback nur früher – Duplikate fängt der Key-Check ab.)
+    # ISO-UTC-Strings sortieren lexikographisch = chronologisch.
+    max_iso = None
     for path in (MOVIES_YAML, EPISODES_YAML):
-        for row in yaml_load(path):
-            if not isinstance(row, dict):
-                continue
+        for row in yaml_scan_fields(path, ("watched_on", "watched_at"), limit=1):
             w = row.get("watched_on") or row.get("watched_at")
             w_iso = f"{w}T00:00:00Z" if w and len(w) == 10 and w.count("-") == 2 else w
-            dt = parse_iso(w_iso) if w_iso else None
-            if dt and (max_dt is None or dt > max_dt):
-                max_dt = dt
-    return max_dt.isoformat().replace("+00:00", "Z") if max_dt else None
+            if w_iso and (max_iso is None or w_iso > max_iso) and parse_iso(w_iso):
+                max_iso = w_iso
+    return parse_iso(max_iso).isoformat().replace("+00:00", "Z") if max_iso else None
 
 def determine_start_at() -> Optional[str]:
-    return read_cursor_env_or_file() or latest_watched_iso_from_yaml()
+    # Reihenfolge: TRAKT_START_AT_ISO → .trakt_cursor → neuester YAML-Eintrag
+    v = os.environ.get("TRAKT_START_AT_ISO", "").strip()
+    if v:
+        return v
+    try:
+        v = CURSOR_FILE.read_text(encoding="utf-8").strip()
+    except OSError:
+        v = ""
+    return v or latest_watched_iso_from_yaml()
 
 def write_cursor(iso_str: str):
-    CURSOR_FILE.write_text(iso_str, encoding="utf-8")
+    write_atomic(CURSOR_FILE, iso_str.encode("utf-8"))
+
+def read_cursor_ids() -> set:
+    try:
+        raw = CURSOR_IDS.read_bytes()
+        return set(orjson.loads(raw) if orjson else json.loads(raw))
+    except (OSError, ValueError, TypeError):
+        return set()
+
+def write_cursor_ids(ids: List[int]):
+    write_atomic(CURSOR_IDS, json_bytes(sorted(ids)))
 
 def save_tokens_file(a: str, r: str):
-    TOKENS_OUT.write_text(json.dumps({"access_token": a, "refresh_token": r}, indent=2), encoding="utf-8")
+    # Halbe Token-Datei wäre fatal: die Rotation würde einen kaputten Refresh-Token setzen
+    write_atomic(TOKENS_OUT, json_bytes({"access_token": a, "refresh_token": r}, indent=True))
 
 def as_dict(v): return v if isinstance(v, dict) else {}
 def as_list(v): return v if isinstance(v, list) else []
 
-def img_or_none(path: Optional[str], variant: str) -> Optional[str]:
-    return f"{IMG_BASE}/{variant}{path}" if path else None
+def img_or_none(path: Optional[str], prefix: str) -> Optional[str]:
+    return prefix + path if path else None
+
+# Lange Texte (overview_de) nicht umbrechen: spart die Einrückung der Folgezeilen
+# und entspricht den älteren Einträgen der Dateien
+YAML_WIDTH = 1 << 30
 
 def prepend_yaml_items(path: Path, items: List[Dict[str, Any]]):
     """Fügt items als YAML-Liste **vorn** ein, ohne bestehende Bytes zu verändern.
-       Existiert die Datei nicht, wird eine vollständige Liste geschrieben."""
+       Existiert die Datei nicht, entsteht daraus eine vollständige Liste."""
     if not items:
         return
-    # Dump der neuen Items (je Item eine Ein-Element-Liste → korrektes '- ' Präfix)
-    new_text = "".join(yaml.safe_dump([it], allow_unicode=True, sort_keys=False) for it in items)
-    if path.exists():
-        orig_text = path.read_text(encoding="utf-8")
-        with path.open("w", encoding="utf-8") as f:
-            f.write(new_text)
-            f.write(orig_text)
-    else:
-        with path.open("w", encoding="utf-8") as f:
-            yaml.safe_dump(items, f, allow_unicode=True, sort_keys=False)
+    # Über Temp-Datei + os.replace, damit ein Abbruch nie eine halbe Datei hinterlässt.
+    # Gestreamt: neue Items einzeln dumpen (je Item eine Ein-Element-Liste → korrektes
+    # '- ' Präfix), danach den Bestand blockweise als Bytes anhängen – nie die ganze
+    # Historie im Speicher
+    # Reste eines abgebrochenen Laufs räumt finally weg; gegen SIGKILL hilft nur
+    # das *.tmp-Muster in .gitignore (der Workflow committet mit git add -A)
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        with tmp.open("w", encoding="utf-8") as f:
+            for it in items:
+                yaml.dump([it], f, Dumper=SafeDumper, allow_unicode=True, sort_keys=False, width=YAML_WIDTH)
+        if path.exists():
+            with path.open("rb") as src, tmp.open("ab") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
 
 # -----------------------------
 # Trakt OAuth / API
@@ -157,15 +266,21 @@ def trakt_refresh_tokens() -> Tuple[bool, Optional[str], Optional[str]]:
         "grant_type": "refresh_token",
     }
     try:
-        r = requests.post(f"{TRAKT_BASE}/oauth/token", json=payload,
-                          headers={"Content-Type":"application/json","User-Agent":USER_AGENT}, timeout=30)
+        # Über SESSION, damit die bestehende Verbindung zu api.trakt.tv wiederverwendet wird;
+        # der (abgelaufene) Bearer-Header wird für diesen Request entfernt.
+        r = SESSION.post(f"{TRAKT_BASE}/oauth/token", data=json_bytes(payload),
+                         headers={"Authorization": None}, timeout=30)
     except requests.RequestException as e:
         log(f"Token-Refresh exception: {e}")
         return False, None, None
     if r.status_code != 200:
         log(f"Token-Refresh failed: {r.status_code} {r.reason} {r.text[:300]}")
         return False, None, None
-    tok = r.json()
+    try:
+        tok = response_json(r)
+    except (requests.RequestException, ValueError) as e:
+        log(f"Token-Refresh: Antwort nicht lesbar: {e}")
+        return False, None, None
     acc, ref = tok.get("access_token"), tok.get("refresh_token")
     if not (acc and ref):
         log("Token-Refresh: Antwort ohne Tokens.")
@@ -176,29 +291,116 @@ def trakt_refresh_tokens() -> Tuple[bool, Optional[str], Optional[str]]:
     save_tokens_file(acc, ref)
     return True, acc, ref
 
-def trakt_get(path: str, params: Optional[Dict[str, Any]] = None, retry_on_401=True) -> requests.Response:
-    url = f"{TRAKT_BASE}{path}"
-    r = SESSION.get(url, params=params or {}, timeout=45)
-    if r.status_code == 401 and retry_on_401:
+_refresh_lock = threading.Lock()
+_refreshed_this_run = False
+
+def refresh_once():
+    # Höchstens ein Refresh pro Lauf: jeder Refresh rotiert den Refresh-Token,
+    # parallele Seitenabrufe mit 401 dürfen ihn nicht mehrfach verbrauchen.
+    global _refreshed_this_run
+    with _refresh_lock:
+        if _refreshed_this_run:
+            return
         log("401 from Trakt → token refresh…")
         ok,_,_ = trakt_refresh_tokens()
         if not ok: raise RuntimeError("Token-Refresh fehlgeschlagen.")
-        r = SESSION.get(url, params=params or {}, timeout=45)
-    r.raise_for_status()
-    return r
+        _refreshed_this_run = True
+
+MAX_BODY_BYTES = 5 * 1024 * 1024   # eine History-Seite hat wenige 100 KB
+
+def trakt_get(path: str, params: Optional[Dict[str, Any]] = None, retry_on_401=True) -> Tuple[bytes, Any]:
+    """(Body, Header) – der Body wird höchstens bis MAX_BODY_BYTES gelesen."""
+    url = f"{TRAKT_BASE}{path}"
+    # stream=True: erst Header prüfen, den Body dann mit Budget lesen (auch ohne
+    # Content-Length bei chunked Antworten); with gibt die Verbindung immer frei
+    r = SESSION.get(url, params=params or {}, timeout=45, stream=True)
+    if r.status_code == 401 and retry_on_401:
+        r.close()
+        refresh_once()
+        r = SESSION.get(url, params=params or {}, timeout=45, stream=True)
+    with r:
+        r.raise_for_status()
+        size = r.headers.get("Content-Length", "")
+        if size.isdigit() and int(size) > MAX_BODY_BYTES:
+            raise RuntimeError(f"Trakt-Antwort zu groß ({size} Bytes) für {path} – abgebrochen.")
+        body = bytearray()
+        for chunk in r.iter_content(64 * 1024):
+            body += chunk
+            if len(body) > MAX_BODY_BYTES:
+                raise RuntimeError(f"Trakt-Antwort zu groß (> {MAX_BODY_BYTES} Bytes) für {path} – abgebrochen.")
+        return bytes(body), r.headers
 
 # -----------------------------
 # TMDB (de-DE)
 # -----------------------------
+def tmdb_cache_path(path: str, params: Dict[str, Any]) -> Path:
+    key = json.dumps([path, sorted(params.items())], ensure_ascii=False)
+    return TMDB_CACHE_DIR / (hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+def tmdb_has_unaired(body: Dict[str, Any]) -> bool:
+    # Season-/Episoden-Antworten haben kein in_production/status → laufend, solange
+    # eine Folge noch kein oder ein künftiges air_date hat
+    if isinstance(body.get("episodes"), list):
+        dates = [e.get("air_date") for e in body["episodes"] if isinstance(e, dict)]
+    elif "episode_number" in body:
+        dates = [body.get("air_date")]
+    else:
+        return False
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+    return any(not d or d >= today for d in dates)
+
+def tmdb_cache_read(cp: Path) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """(Eintrag, frisch?) – abgelaufene Einträge bleiben für die Revalidierung per ETag."""
+    try:
+        entry = orjson.loads(cp.read_bytes()) if orjson else json.loads(cp.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None, False
+    body = entry.get("body") if isinstance(entry, dict) else None
+    if not isinstance(body, dict):
+        return None, False
+    airing = (body.get("in_production") or body.get("status") == "Returning Series"
+              or tmdb_has_unaired(body))
+    ttl = TMDB_CACHE_TTL_AIRING if airing else TMDB_CACHE_TTL
+    return entry, time.time() - (entry.get("fetched_at") or 0) < ttl
+
+def tmdb_cache_write(cp: Path, body: Dict[str, Any], etag: Optional[str] = None, last_modified: Optional[str] = None):
+    try:
+        cp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cp.with_name(f"{cp.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(json_bytes({"fetched_at": int(time.time()), "etag": etag,
+                                    "last_modified": last_modified, "body": body}))
+        os.replace(tmp, cp)
+    except OSError as e:
+        log(f"Warn: TMDB-Cache nicht schreibbar ({cp.name}): {e}")
+
 def tmdb_get(path: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    p = dict(params); p["api_key"]=TMDB_API_KEY; p.setdefault("language","de-DE")
+    p = dict(params); p.setdefault("language","de-DE")
+    cp = tmdb_cache_path(path, p)
+    entry, fresh = tmdb_cache_read(cp)
+    if fresh:
+        return entry["body"]
+    # Abgelaufen, aber mit ETag/Last-Modified → bedingter GET; 304 spart Body + JSON-Parsing
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
     try:
-        resp = requests.get(f"{TMDB_BASE}{path}", params=p, timeout=45)
+        resp = TMDB_SESSION.get(f"{TMDB_BASE}{path}", params=p, headers=headers or None, timeout=45)
+        if resp.status_code == 304 and entry:
+            tmdb_cache_write(cp, entry["body"], entry.get("etag"), entry.get("last_modified"))
+            return entry["body"]
         if resp.status_code != 200: return None
-        return resp.json()
-    except requests.RequestException:
+        data = response_json(resp)
+    except (requests.RequestException, ValueError):
         return None
+    if isinstance(data, dict):
+        tmdb_cache_write(cp, data, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+    return data
 
+# Binges: viele Folgen teilen Show/Season → pro Lauf nur einmal auflösen.
+# (Rückgabe-Dicts werden nur gelesen, Teilen ist unkritisch.)
+@functools.lru_cache(maxsize=None)
 def enrich_show(show_tmdb_id: Optional[int], title: Optional[str], year: Optional[int]) -> Dict[str, Any]:
     show={}
     if show_tmdb_id:
@@ -216,14 +418,26 @@ def enrich_show(show_tmdb_id: Optional[int], title: Optional[str], year: Optiona
 
 def enrich_episode(show_tmdb_id: Optional[int], season: Optional[int], number: Optional[int]) -> Dict[str, Any]:
     if not (show_tmdb_id and season is not None and number is not None): return {}
+    # Die (gecachte) Season-Antwort enthält alle Folgen mit Name/Laufzeit/Still →
+    # Folgen derselben Staffel brauchen keinen eigenen Request – außer Name oder
+    # Still fehlen noch (frisch ausgestrahlt), dann wird die Folge einzeln geholt
+    hit={}
+    for ep in as_list(enrich_season_meta(show_tmdb_id, season).get("episodes")):
+        if isinstance(ep, dict) and ep.get("episode_number") == number:
+            if ep.get("name") and ep.get("still_path"):
+                return ep
+            hit=ep
+            break
     ep=tmdb_get(f"/tv/{show_tmdb_id}/season/{season}/episode/{number}", {"append_to_response":"external_ids"})
-    return ep or {}
+    return ep or hit
 
+@functools.lru_cache(maxsize=None)
 def enrich_season_meta(show_tmdb_id: Optional[int], season: Optional[int]) -> Dict[str, Any]:
     if not (show_tmdb_id and season is not None): return {}
     det=tmdb_get(f"/tv/{show_tmdb_id}/season/{season}", {})
     return det or {}
 
+@functools.lru_cache(maxsize=None)
 def enrich_movie_by_tmdb_ids(tmdb_id: Optional[int], imdb_id: Optional[str], title: str, year: Optional[int]) -> Dict[str, Any]:
     movie={}
     if tmdb_id:
@@ -245,6 +459,29 @@ def enrich_movie_by_tmdb_ids(tmdb_id: Optional[int], imdb_id: Optional[str], tit
             if det: movie=det
     return movie or {}
 
+def enrich_movie_item(m: Dict[str, Any]) -> Dict[str, Any]:
+    ids=as_dict(m.get("ids"))
+    m["tmdb"]=enrich_movie_by_tmdb_ids(ids.get("tmdb"), ids.get("imdb"), m.get("title") or "", m.get("year")) or {}
+    return movie_to_frontend(m)
+
+def show_lookup_key(e: Dict[str, Any]) -> Tuple[Optional[int], Optional[str], Optional[int]]:
+    # Argumente für enrich_show
+    return as_dict(as_dict(e.get("ids")).get("show")).get("tmdb"), e.get("show"), e.get("year")
+
+def resolved_show_id(key) -> Optional[int]:
+    # TMDB-ID der Show nach dem Lookup (Fallback: die ID aus Trakt)
+    show_det=enrich_show(*key)
+    return show_det.get("id") if show_det else key[0]
+
+def enrich_episode_item(e: Dict[str, Any]) -> Dict[str, Any]:
+    key = show_lookup_key(e)
+    show_det=enrich_show(*key) or {}
+    show_id=resolved_show_id(key)
+    e["tmdb_show"]=show_det
+    e["tmdb_episode"]=enrich_episode(show_id, e.get("season"), e.get("episode")) or {}
+    e["tmdb_season"]=enrich_season_meta(show_id, e.get("season")) or {}
+    return episode_to_frontend(e)
+
 # -----------------------------
 # Normalisierung
 # -----------------------------
@@ -289,15 +526,15 @@ def episode_to_frontend(e: Dict[str, Any]) -> Dict[str, Any]:
         "slug": show_ids.get("slug"),
         "source": "trakt",
         "show_title_de": tmdb_show.get("name") or e.get("show"),
-        "show_poster": img_or_none(tmdb_show.get("poster_path"), "w500"),
-        "show_backdrop": img_or_none(tmdb_show.get("backdrop_path"), "w780"),
+        "show_poster": img_or_none(tmdb_show.get("poster_path"), POSTER_W500),
+        "show_backdrop": img_or_none(tmdb_show.get("backdrop_path"), BACKDROP_W780),
         "show_total_episodes": tmdb_show.get("number_of_episodes"),
         "episode_title": e.get("title") or tmdb_ep.get("name"),
         "episode_title_de": tmdb_ep.get("name"),
         "episode_runtime": ep_runtime,
         "season_total_episodes": season_total,
-        "episode_still": img_or_none(tmdb_ep.get("still_path"), "w300"),
-    }.items() if v is not None}
+        "episode_still": img_or_none(tmdb_ep.get("still_path"), STILL_W300),
+    }.items() if v is not None and v != ""}
 
 def movie_to_frontend(m: Dict[str, Any]) -> Dict[str, Any]:
     ids=as_dict(m.get("ids")); tmdb=as_dict(m.get("tmdb"))
@@ -310,17 +547,21 @@ def movie_to_frontend(m: Dict[str, Any]) -> Dict[str, Any]:
         "slug": ids.get("slug"),
         "plays": 1,
         "watched_on": only_date(m.get("watched_on")),
-        "poster": img_or_none(tmdb.get("poster_path"), "w500"),
-        "backdrop": img_or_none(tmdb.get("backdrop_path"), "w780"),
+        "poster": img_or_none(tmdb.get("poster_path"), POSTER_W500),
+        "backdrop": img_or_none(tmdb.get("backdrop_path"), BACKDROP_W780),
         "source": "trakt",
         "runtime": tmdb.get("runtime"),
         "title_de": tmdb.get("title") or tmdb.get("original_title") or m.get("title"),
         "overview_de": tmdb.get("overview"),
-    }.items() if v is not None}
+    }.items() if v is not None and v != ""}
 
 # -----------------------------
 # Keys (Duplikat-Erkennung)
 # -----------------------------
+# Felder, aus denen legacy_*_key die Duplikat-Keys bildet
+EP_KEY_FIELDS  = ("show", "season", "episode", "watched_on")
+MOV_KEY_FIELDS = ("trakt", "imdb", "tmdb", "title", "watched_on")
+
 def legacy_ep_key(r: Dict[str, Any]):
     r = r if isinstance(r, dict) else {}
     return ("ep", r.get("show"), r.get("season"), r.get("episode"), r.get("watched_on"))
@@ -330,19 +571,66 @@ def legacy_mov_key(r: Dict[str, Any]):
     preferred_id = r.get("trakt") or r.get("imdb") or r.get("tmdb") or r.get("title")
     return ("mov", preferred_id, r.get("watched_on"))
 
+def prelim_mov_key(m: Dict[str, Any]):
+    # Key aus reinen Trakt-Feldern (vor TMDB); None, wenn legacy_mov_key erst
+    # nach dem Enrichment feststeht (keine ID außer Titel)
+    ids = as_dict(m.get("ids"))
+    pid = ids.get("trakt") or ids.get("imdb") or ids.get("tmdb")
+    return ("mov", pid, only_date(m.get("watched_on"))) if pid else None
+
+def prelim_ep_key(e: Dict[str, Any]):
+    return ("ep", e.get("show"), e.get("season"), e.get("episode"), only_date(e.get("watched_on")))
+
+def only_new(rows: List[Dict[str, Any]], seen: set, key_fn) -> List[Dict[str, Any]]:
+    # O(1)-Lookup je Kandidat; seen wird fortgeschrieben → auch Dubletten
+    # innerhalb der neuen Rows fliegen raus
+    out = []
+    for row in rows:
+        k = key_fn(row)
+        if k not in seen:
+            seen.add(k)
+            out.append(row)
+    return out
+
 # -----------------------------
 # Fetch History
 # -----------------------------
-def fetch_trakt_history(start_at: Optional[str], limit: int, pages: int) -> List[Dict[str, Any]]:
-    out=[]
-    for page in range(1, pages+1):
+def fetch_trakt_history(start_at: Optional[str], limit: int, pages: int) -> Iterator[Dict[str, Any]]:
+    """Liefert die History-Einträge seitenweise, sobald die jeweilige Seite da ist."""
+    def fetch_page(page: int, end_at: Optional[str] = None) -> Tuple[bytes, Any]:
         params={"limit":limit,"page":page}
         if start_at: params["start_at"]=start_at
-        r=trakt_get("/sync/history", params=params)
-        batch=r.json()
-        if not batch: break
-        out.extend(batch)
-    return out
+        if end_at: params["end_at"]=end_at
+        return trakt_get("/sync/history", params=params)
+
+    def page_items(body: bytes, page: int) -> List[Dict[str, Any]]:
+        # Kaputte Seite → ganzer Lauf ohne Schreiben abbrechen; einzelne Seiten
+        # zu überspringen hieße, dass der Cursor über fehlende Einträge springt
+        try:
+            return json_loads(body) or []
+        except ValueError as e:
+            raise RuntimeError(f"Trakt-History Seite {page} nicht lesbar: {e}") from e
+
+    # Seite 1 allein (ein evtl. 401-Refresh passiert hier, nicht in mehreren Threads);
+    # X-Pagination-Page-Count sagt, wie viele Seiten es gibt → keine Leer-Abfrage am Ende.
+    body, headers=fetch_page(1)
+    first=page_items(body, 1)
+    try:
+        page_count=int(headers.get("X-Pagination-Page-Count", ""))
+    except ValueError:
+        page_count=pages if len(first) >= limit else 1   # ohne Header: volle Seite → weiterblättern
+    yield from first
+    last=min(pages, page_count)
+    if last < 2:
+        return
+    # Fenster oben auf den neuesten Eintrag von Seite 1 festlegen: ein während des
+    # Abrufs neu erfasster Watch würde sonst alle Seiten verschieben, und bei
+    # parallel geholten Seiten fiele ein Eintrag an einer Seitengrenze heraus
+    end_at=first[0].get("watched_at") if first and isinstance(first[0], dict) else None
+    with ThreadPoolExecutor(max_workers=min(last-1, 4)) as ex:
+        for batch in ex.map(lambda p: page_items(fetch_page(p, end_at)[0], p), range(2, last+1)):
+            if not batch: break
+            yield from batch
 
 # -----------------------------
 # MAIN
@@ -351,62 +639,58 @@ def main():
     start_at = determine_start_at()
     log(f"Starte ab: {start_at}" if start_at else "Kein Cursor – hole aktuelle History ohne start_at.")
 
-    limit=int(os.environ.get("TRAKT_HISTORY_LIMIT","200"))
-    pages=int(os.environ.get("TRAKT_HISTORY_PAGES","5"))
-    history=fetch_trakt_history(start_at, limit, pages)
-    log(f"Fetched {len(history)} history items von Trakt.")
+    # Der Cursor liegt 1s vor dem neuesten Eintrag → diese Einträge kommen jedes Mal
+    # erneut; bereits gesehene IDs gar nicht erst normalisieren/anreichern
+    seen_ids = read_cursor_ids() if start_at else set()
 
-    # Normalisieren
+    # Abrufen + Normalisieren in einem Durchgang (Seiten werden verarbeitet, sobald sie da sind)
     movies_norm, episodes_norm = [], []
-    for it in history:
-        if it.get("type")=="movie":
+    fetched = skipped = 0
+    for it in fetch_trakt_history(start_at, HISTORY_LIMIT, HISTORY_PAGES):
+        fetched += 1
+        if it.get("id") in seen_ids:
+            skipped += 1
+            continue
+        kind = it.get("type")
+        if kind=="movie":
             nm=normalize_movie_item(it)
             if nm: movies_norm.append(nm)
-        elif it.get("type")=="episode":
+        elif kind=="episode":
             ne=normalize_episode_item(it)
             if ne: episodes_norm.append(ne)
+    log(f"Fetched {fetched} history items von Trakt.")
+    if skipped:
+        log(f"{skipped} bereits gesehene Einträge übersprungen.")
+
+    # Bestehende YAMLs nur zum Duplikat-Check einlesen (nicht überschreiben!) –
+    # und nur, wenn es für die Datei überhaupt Kandidaten gibt
+    # (nur die Key-Felder, per Event-Stream statt kompletter Deserialisierung)
+    mov_keys = {legacy_mov_key(r) for r in yaml_scan_fields(MOVIES_YAML, MOV_KEY_FIELDS)} if movies_norm else set()
+    ep_keys  = {legacy_ep_key(r) for r in yaml_scan_fields(EPISODES_YAML, EP_KEY_FIELDS)} if episodes_norm else set()
+
+    # Bekannte Einträge schon vor TMDB aussortieren (kein Enrichment für Verwerfbares)
+    movies_todo = [m for m in movies_norm if prelim_mov_key(m) not in mov_keys]
+    eps_todo    = [e for e in episodes_norm if prelim_ep_key(e) not in ep_keys]
+    skipped = len(movies_norm) + len(episodes_norm) - len(movies_todo) - len(eps_todo)
+    if skipped:
+        log(f"{skipped} bereits vorhandene Einträge ohne TMDB-Abruf übersprungen.")
 
     # Enrichment → Legacy-Mapping (NEUE Items vorbereiten)
-    # Movies
-    new_movies_legacy=[]
-    for m in movies_norm:
-        ids=as_dict(m.get("ids"))
-        info=enrich_movie_by_tmdb_ids(ids.get("tmdb"), ids.get("imdb"), m.get("title") or "", m.get("year")) or {}
-        m["tmdb"]=info
-        new_movies_legacy.append(movie_to_frontend(m))
-    # Episodes
-    new_eps_legacy=[]
-    for e in episodes_norm:
-        show_ids=as_dict(as_dict(e.get("ids")).get("show"))
-        tmdb_show_id = show_ids.get("tmdb")
-        show_det=enrich_show(tmdb_show_id, e.get("show"), e.get("year")) or {}
-        ep_det=enrich_episode(show_det.get("id") if show_det else tmdb_show_id, e.get("season"), e.get("episode")) or {}
-        season_meta=enrich_season_meta(show_det.get("id") if show_det else tmdb_show_id, e.get("season")) or {}
-        e["tmdb_show"]=show_det; e["tmdb_episode"]=ep_det; e["tmdb_season"]=season_meta
-        new_eps_legacy.append(episode_to_frontend(e))
-
-    # Bestehende YAMLs nur zum Duplikat-Check einlesen (nicht überschreiben!)
-    existing_movies = [r for r in yaml_load(MOVIES_YAML) if isinstance(r, dict)]
-    existing_eps    = [r for r in yaml_load(EPISODES_YAML) if isinstance(r, dict)]
-
-    mov_keys = { legacy_mov_key(r) for r in existing_movies }
-    ep_keys  = { legacy_ep_key(r)  for r in existing_eps }
+    # TMDB-Abrufe sind rein latenzgebunden → Items parallel anreichern;
+    # ex.map hält die Reihenfolge der History bei.
+    with ThreadPoolExecutor(max_workers=TMDB_WORKERS) as ex:
+        # Shows und Staffeln vorab einmal je Schlüssel auflösen, damit parallele Folgen
+        # derselben Serie/Staffel nicht gleichzeitig dieselben Abrufe starten
+        shows={show_lookup_key(e) for e in eps_todo}
+        show_ids=dict(zip(shows, ex.map(resolved_show_id, shows)))
+        seasons={(show_ids[show_lookup_key(e)], e.get("season")) for e in eps_todo}
+        list(ex.map(lambda k: enrich_season_meta(*k), seasons))
+        new_movies_legacy=list(ex.map(enrich_movie_item, movies_todo))
+        new_eps_legacy=list(ex.map(enrich_episode_item, eps_todo))
 
     # Nur wirklich neue Einträge vorn einfügen
-    to_prepend_movies = []
-    to_prepend_eps    = []
-
-    for row in new_movies_legacy:
-        k = legacy_mov_key(row)
-        if k not in mov_keys:
-            to_prepend_movies.append(row)
-            mov_keys.add(k)
-
-    for row in new_eps_legacy:
-        k = legacy_ep_key(row)
-        if k not in ep_keys:
-            to_prepend_eps.append(row)
-            ep_keys.add(k)
+    to_prepend_movies = only_new(new_movies_legacy, mov_keys, legacy_mov_key)
+    to_prepend_eps    = only_new(new_eps_legacy, ep_keys, legacy_ep_key)
 
     if to_prepend_movies:
         prepend_yaml_items(MOVIES_YAML, to_prepend_movies)
@@ -421,15 +705,16 @@ def main():
         log("Episodes: nichts einzufügen.")
 
     # Cursor fortschreiben: neuestes watched_on – 1s
-    newest_ts = None
-    for it in (movies_norm + episodes_norm):
-        ts = it.get("watched_on")
-        if ts and (newest_ts is None or ts > newest_ts):
-            newest_ts = ts
+    # (ISO-UTC-Strings: lexikographisches max = neuestes; geparst wird nur der Gewinner)
+    fetched = movies_norm + episodes_norm
+    newest_ts = max((it["watched_on"] for it in fetched if it.get("watched_on")), default=None)
     if newest_ts:
         dt = parse_iso(newest_ts)
         cursor_iso = (dt - timedelta(seconds=1)).isoformat().replace("+00:00","Z") if dt else newest_ts
         write_cursor(cursor_iso)
+        # Sekundengenaue ISO-UTC-Präfixe vergleichen lexikographisch = chronologisch
+        write_cursor_ids([it["history_id"] for it in fetched
+                          if it.get("history_id") is not None and (it.get("watched_on") or "")[:19] >= cursor_iso[:19]])
         log(f"Cursor aktualisiert auf: {cursor_iso}")
     else:
         log("Keine neuen watched_at-Zeiten – Cursor unverändert.")